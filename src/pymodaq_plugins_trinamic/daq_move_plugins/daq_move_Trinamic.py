@@ -1,9 +1,11 @@
 import time
+from types import SimpleNamespace
 from typing import Union, List, Dict, Tuple
 from pymodaq.control_modules.move_utility_classes import (DAQ_Move_base, comon_parameters_fun,
                                                           main, DataActuatorType, DataActuator)
 
 from pymodaq_utils.utils import ThreadCommand  # object used to send info back to the main thread
+from pymodaq_utils.logger import set_logger, get_module_name
 from pymodaq_gui.parameter import Parameter
 from pymodaq_plugins_trinamic.hardware.trinamic import TrinamicManager, TrinamicController, EndStopHitSignal
 from qtpy import QtCore
@@ -12,6 +14,8 @@ from pymodaq.control_modules.thread_commands import ThreadStatus
 
 from pytrinamic.modules import TMCM1311
 
+logger = set_logger(get_module_name(__file__))
+
 class DAQ_Move_Trinamic(DAQ_Move_base):
     """
         * This has been tested with the TMCM-1311 Trinamic stepper motor controller
@@ -25,18 +29,23 @@ class DAQ_Move_Trinamic(DAQ_Move_base):
     data_actuator_type = DataActuatorType.DataActuator
     _epsilon: Union[float, List[float]] = 1 # At best, we can tell our Trinamic to move by one microstep
 
-    # Initialize communication at 
-    manager = TrinamicManager(baudrate=115200)
-    devices = manager.probe_tmcl_ports()
+    _position_cache_ms: float = 20.0  # A position read more recently than this is reused instead of querying the bus
+    _encoder_detection_timeout_s: float = 5.0
+    _closed_loop_timeout_s: float = 5.0
+
+    _baudrate: int = 115200
+    # Only enumerates the serial ports (none is opened), so the device list is available before Init
+    _devices = TrinamicManager(baudrate=_baudrate).probe_tmcl_ports()
 
     params = [
                 {'title': 'Device Management:', 'name': 'device_manager', 'type': 'group', 'children': [
                     {'title': 'Refresh Device List:', 'name': 'refresh_devices', 'type': 'bool_push', 'value': False},
-                    {'title': 'Connected Devices:', 'name': 'connected_devices', 'type': 'list', 'limits': devices['ports']},
+                    {'title': 'Connected Devices:', 'name': 'connected_devices', 'type': 'list', 'limits': _devices['ports'],
+                     'value': _devices['ports'][0] if _devices['ports'] else None},
                     {'title': 'Selected Device:', 'name': 'selected_device', 'type': 'str', 'value': '', 'readonly': True},
                     {"title": "Device Serial Number", "name": "device_serial_number", "type": "str", "value": "", 'readonly': True},
                     {"title": "Device User ID", "name": "device_user_id", "type": "str", "value": ""},
-                    {'title': 'Baudrate:', 'name': 'baudrate', 'type': 'str', 'value': '115200', 'readonly': True}
+                    {'title': 'Baudrate:', 'name': 'baudrate', 'type': 'str', 'value': str(_baudrate), 'readonly': True}
                 ]},
                 {'title': 'Closed loop?:', 'name': 'closed_loop', 'type': 'led_push', 'value': False, 'default': False},
                 {'title': 'Encoder Settings:', 'name': 'encoder', 'type': 'group', 'children': [
@@ -64,13 +73,51 @@ class DAQ_Move_Trinamic(DAQ_Move_base):
 
     def ini_attributes(self):
         self.controller: TrinamicController = None
+        self.manager = TrinamicManager(baudrate=self._baudrate)
         self.user_id = None
         self._last_poll_time = 0.0  # Used to throttle polling frequency
+        self._cached_position = None
+        self._cached_position_time = 0.0
         self._signals = None
+        self._encoder_timer = None
+        self._encoder_deadline = 0.0
+
+        # Parameters accessed repeatedly, looked up once in the settings tree
+        self._params = SimpleNamespace(
+            closed_loop=self.settings.child('closed_loop'),
+            connected_devices=self.settings.child('device_manager', 'connected_devices'),
+            refresh_devices=self.settings.child('device_manager', 'refresh_devices'),
+            selected_device=self.settings.child('device_manager', 'selected_device'),
+            device_serial_number=self.settings.child('device_manager', 'device_serial_number'),
+            device_user_id=self.settings.child('device_manager', 'device_user_id'),
+            detect_encoder=self.settings.child('encoder', 'detect_encoder'),
+            encoder_resolution=self.settings.child('encoder', 'encoder_resolution'),
+            encoder_position=self.settings.child('encoder', 'encoder_position'),
+            set_reference_position=self.settings.child('positioning', 'set_reference_position'),
+        )
+
+        # commit_settings dispatch, each handler receives the new value of the parameter
+        self._commit_handlers = {
+            'closed_loop': self._on_closed_loop,
+            'refresh_devices': self._on_refresh_devices,
+            'set_reference_position': self._on_set_reference_position,
+            'detect_encoder': self._on_detect_encoder,
+            'encoder_resolution': self._on_encoder_resolution,
+            'use_scaling': lambda value: self.poll_moving(),  # Just use this current value in UI
+            'device_user_id': lambda value: setattr(self, 'user_id', value),
+            'endstop_handling': self._on_endstop_handling,
+        }
+        for name in ('max_velocity', 'max_acceleration', 'microstep_resolution',
+                     'max_current', 'standby_current', 'boost_current'):
+            self._commit_handlers[name] = lambda value, name=name: setattr(self.controller, name, value)
 
     def get_actuator_value(self):
-        self._throttle_polling(20.0)  # wait 20 ms between polls
-        pos = DataActuator(data=self.controller.actual_position)
+        age_ms = (time.perf_counter() - self._cached_position_time) * 1000
+        if self._cached_position is None or age_ms >= self._position_cache_ms:
+            self._throttle_polling(20.0)  # wait 20 ms between polls
+            self._cached_position = self.controller.actual_position
+            self._cached_position_time = time.perf_counter()
+        pos = DataActuator(data=self._cached_position)
         return self.get_position_with_scaling(pos)
 
     def user_condition_to_reach_target(self) -> bool:
@@ -80,30 +127,35 @@ class DAQ_Move_Trinamic(DAQ_Move_base):
         self._throttle_polling(20)
         if self.controller.motor.get_position_reached():
             return True
-        # Check endstops while moving
-        else:
+
+        # Check endstops while moving, only if someone listens for them
+        if self._signals is not None:
             # Throttle before left endstop check
             self._throttle_polling(20)
             if self.controller.motor.get_axis_parameter(self.controller.motor.AP.LeftEndstop):
-                if self._signals is not None:
-                    self._signals.end_stop_hit.emit("left")
+                self._signals.end_stop_hit.emit("left")
 
             # Throttle before right endstop check
             self._throttle_polling(20)
             if self.controller.motor.get_axis_parameter(self.controller.motor.AP.RightEndstop):
-                if self._signals is not None:
-                    self._signals.end_stop_hit.emit("right")
+                self._signals.end_stop_hit.emit("right")
 
         return False
 
     def close(self):
         """Terminate the communication protocol"""
+        # Stop everything that may still talk to the motor before releasing the port
+        if self._encoder_timer is not None:
+            self._encoder_timer.stop()
+        if self._signals is not None:
+            self._signals.end_stop_hit.disconnect(self.on_end_stop_hit)
+            self._signals = None
         if self.is_master:
             port = self.controller.port
             self.controller.port = ''
             self.manager.close(port)
+            logger.info("Closed connection to device on port %s", port)
 
-        print("Closed connection to device on port {}".format(port))
         self.controller = None
 
     def commit_settings(self, param: Parameter):
@@ -114,85 +166,9 @@ class DAQ_Move_Trinamic(DAQ_Move_base):
         param: Parameter
             A given parameter (within detector_settings) whose value has been changed by the user
         """
-        name = param.name()
-        value = param.value()
-        if name == 'closed_loop':
-            self.controller.set_closed_loop_mode(value)
-        elif name == 'refresh_devices':
-            param = self.settings['refresh_list']
-            param.setValue(False)
-            param.sigValueChanged(param, False)
-            devices = self.manager.probe_tmcl_ports()
-            self.settings.child('device_manager', 'connected_devices').setLimits(devices['ports'])
-        elif name == 'max_velocity':
-            self.controller.max_velocity = value
-        elif name == 'max_acceleration':
-            self.controller.max_acceleration = value
-        elif name == 'microstep_resolution':
-            self.controller.microstep_resolution = value
-        elif name == 'set_reference_position':
-            if value:
-                self.controller.set_reference_position()
-                param = self.settings.child('positioning', 'set_reference_position')
-                param.setValue(False)
-                param.sigValueChanged.emit(param, False)
-        elif name =='max_current':
-            self.controller.max_current = value
-        elif name =='standby_current':
-            self.controller.standby_current = value
-        elif name == 'boost_current':
-            self.controller.boost_current = value
-        elif name == 'detect_encoder':
-            # detect encoder resolution
-            if value:
-                print("Detecting encoder resolution")
-                self.emit_status(ThreadCommand('Update_Status', ["Detecting encoder resolution"]))
-                self.controller.motor.set_axis_parameter(self.controller.motor.AP.EncoderInitialization, 1)
-                timeout = 0
-                while self.controller.motor.get_axis_parameter(self.controller.motor.AP.EncoderInitialization) != 2:
-                    QtCore.QThread.msleep(100)
-                    timeout += 0.1
-                    if timeout >= 5:
-                        print("Timeout while detecting encoder resolution")
-                        self.emit_status(ThreadCommand('Update_Status', ["Timeout while detecting encoder resolution"]))
-                        param = self.settings.child('encoder', 'detect_encoder')
-                        param.setValue(False)
-                        param.sigValueChanged.emit(param, False)
-                        return
-                self.settings.child('encoder', 'encoder_resolution').setValue(self.controller.motor.get_axis_parameter(self.controller.motor.AP.EncoderResolution))
-                param = self.settings.child('encoder', 'detect_encoder')
-                param.setValue(False)
-                param.sigValueChanged.emit(param, False)
-                self.emit_status(ThreadCommand('Update_Status', ["Encoder resolution = {}".format(self.controller.motor.get_axis_parameter(self.controller.motor.AP.EncoderResolution))]))
-        elif name == 'encoder_resolution':
-            if value > 0:
-                self.controller.motor.set_axis_parameter(self.controller.motor.AP.EncoderResolution, value)
-                self.settings.child('encoder', 'encoder_position').setValue(0)    
-        elif name == 'use_scaling':
-            # Just use this current value in UI
-            self.poll_moving()
-        elif name == 'device_user_id':
-            self.user_id = value
-        elif name == 'endstop_handling':
-            if value:
-                # Enable endstop detection
-                self.controller.motor.set_axis_parameter(self.controller.motor.AP.RightLimitSwitchDiable, 0)
-                self._throttle_polling(10)
-                self.controller.motor.set_axis_parameter(self.controller.motor.AP.LeftLimitSwitchDisable, 0)
-
-                # Connect end stop hit signal
-                self._signals = EndStopHitSignal()
-                self._signals.end_stop_hit.connect(self.on_end_stop_hit)
-            else:
-                # Disable endstop detection
-                self.controller.motor.set_axis_parameter(self.controller.motor.AP.RightLimitSwitchDiable, 1)
-                self._throttle_polling(10)
-                self.controller.motor.set_axis_parameter(self.controller.motor.AP.LeftLimitSwitchDisable, 1)
-
-                # Disconnect end stop hit signal
-                self._signals.end_stop_hit.disconnect(self.on_end_stop_hit)
-                self._signals = None
-        
+        handler = self._commit_handlers.get(param.name())
+        if handler is not None:
+            handler(param.value())
 
     def ini_stage(self, controller=None):
         """Actuator communication initialization
@@ -208,12 +184,13 @@ class DAQ_Move_Trinamic(DAQ_Move_base):
         initialized: bool
             False if initialization failed otherwise True
         """
-        # Always get a fresh list on device initialization
-        devices = self.manager.probe_tmcl_ports()
-        self.settings.child('device_manager', 'connected_devices').setLimits(devices['ports'])
-        index = devices['ports'].index(self.settings.child('device_manager', 'connected_devices').value())
+        # Reuse the probe behind the device list, re-probe only if the selected port is missing from it
+        devices = self.manager.devices if self.manager.devices is not None else self._devices
+        if self._params.connected_devices.value() not in devices['ports']:
+            devices = self._refresh_device_list(force=True)
+        index = devices['ports'].index(self._params.connected_devices.value())
         device_info = {'port': devices['ports'][index], 'serial_number': devices['serial_numbers'][index]}
-        self.user_id = self.settings.child('device_manager', 'device_user_id').value()
+        self.user_id = self._params.device_user_id.value()
 
         self.ini_stage_init(slave_controller=controller)  # will be useful when controller is slave
 
@@ -226,26 +203,27 @@ class DAQ_Move_Trinamic(DAQ_Move_base):
         
         # Establish connection
         self.manager.connect(self.controller.port)
-        self.controller.connect_module(TMCM1311, self.manager.interfaces[self.manager.connections.index(self.controller.port)])
+        self.controller.connect_module(TMCM1311, self.manager.interfaces_by_port[self.controller.port])
         self.controller.connect_motor()
-        self.settings.child('device_manager', 'selected_device').setValue(self.controller.port)
-        self.settings.child('device_manager', 'device_serial_number').setValue(self.controller.serial_number)
-
-        # Preparing drive settings
-        self.controller.max_current = self.settings.child('drive', 'max_current').value()
-        self.controller.standby_current = self.settings.child('drive', 'standby_current').value()
-        self.controller.boost_current = self.settings.child('drive', 'boost_current').value()
-
-        # Microstep resolution
-        self.controller.microstep_resolution = self.settings.child('positioning', 'microstep_resolution').value()
-
-        # Preparing linear ramp settings
-        self.controller.max_velocity = self.settings.child('motion', 'max_velocity').value()
-        self.controller.max_acceleration = self.settings.child('motion', 'max_acceleration').value()
+        self._params.selected_device.setValue(self.controller.port)
+        self._params.device_serial_number.setValue(self.controller.serial_number)
+
+        # Preparing drive settings, microstep resolution and linear ramp settings
+        self.controller.apply_settings(
+            max_current=self.settings.child('drive', 'max_current').value(),
+            standby_current=self.settings.child('drive', 'standby_current').value(),
+            boost_current=self.settings.child('drive', 'boost_current').value(),
+            microstep_resolution=self.settings.child('positioning', 'microstep_resolution').value(),
+            max_velocity=self.settings.child('motion', 'max_velocity').value(),
+            max_acceleration=self.settings.child('motion', 'max_acceleration').value(),
+        )
 
         # This setting never relevant for TMCM1311
         self.settings.child('multiaxes').hide()
 
+        # Baudrate is meaningless for the native USB CDC port of the module, shown again for serial adapters
+        self.settings.child('device_manager', 'baudrate').show(not devices['native_usb'][index])
+
         # Set initial timeout very large
         self.settings.child('timeout').setValue(100)
 
@@ -261,11 +239,15 @@ class DAQ_Move_Trinamic(DAQ_Move_base):
         """
         position = self.check_bound(position)  #if user checked bounds, the defined bounds are applied here
         self.target_value = position
-        position = self.set_position_with_scaling(position)  # apply scaling if the user specified one
-        self.controller.set_absolute_motion()
-        self.controller.move_to(int(round(position.value())))
-        
-        self.emit_status(ThreadCommand('Update_Status', ['Moving to absolute position: {}'.format(self.get_position_with_scaling(position).value())]))
+        scaled_position = self.set_position_with_scaling(position)  # apply scaling if the user specified one
+        steps = int(round(scaled_position.value()))
+        if not self._is_resting_at(steps):
+            self.controller.set_absolute_motion()
+            self.controller.move_to(steps)
+        self._invalidate_position()
+
+        # position is still in user units, no need to undo the scaling for the status message
+        self._update_status(f'Moving to absolute position: {position.value()}')
 
     def move_rel(self, position: DataActuator):
         """ Move the actuator to the relative target actuator value defined by position
@@ -276,36 +258,137 @@ class DAQ_Move_Trinamic(DAQ_Move_base):
         """
         position = self.check_bound(self.current_position + position) - self.current_position
         self.target_value = position + self.current_position
-        position = self.set_position_relative_with_scaling(position)
-        self.controller.set_relative_motion()
-        self.controller.move_by(int(round(position.value())))
+        scaled_position = self.set_position_relative_with_scaling(position)
+        steps = int(round(scaled_position.value()))
+        if steps != 0:
+            self.controller.set_relative_motion()
+            self.controller.move_by(steps)
+        self._invalidate_position()
 
-        self.emit_status(ThreadCommand('Update_Status', ['Moving by: {}'.format(self.get_position_with_scaling(position).value())]))
+        self._update_status(f'Moving by: {position.value()}')
 
     def move_home(self):
         """Call the reference method of the controller"""
         self.target_value = 0 # This
-        self.controller.move_to_reference()
-        self.emit_status(ThreadCommand('Update_Status', ['Moving to zero position']))
+        if not self._is_resting_at(0):
+            self.controller.move_to_reference()
+        self._invalidate_position()
+        self._update_status('Moving to zero position')
         self.poll_moving() # And this are how we will know when we have made it to our reference position 
 
     def stop_motion(self):
         """Stop the actuator and emits move_done signal"""
         self.controller.stop()
         time.sleep(0.05)  # Brief delay to ensure motor has stopped
+        self._cached_position = None
         actual_pos = self.get_actuator_value()
         self.current_position = actual_pos
         self.target_value = actual_pos  # Reset target to current position
         self.move_done()
-        self.emit_status(ThreadCommand('Update_Status', ['Stop motion']))
+        self._update_status('Stop motion')
 
     def on_end_stop_hit(self, endstop: str):
         self.stop_motion()
         if endstop == 'left':
-            self.emit_status(ThreadCommand('Update_Status', ['Left end stop hit']))
+            self._update_status('Left end stop hit')
         else:
-            self.emit_status(ThreadCommand('Update_Status', ['Right end stop hit']))
-
+            self._update_status('Right end stop hit')
+
+
+    def _on_closed_loop(self, value: bool):
+        try:
+            self.controller.set_closed_loop_mode(value, timeout=self._closed_loop_timeout_s)
+        except TimeoutError as e:
+            self._update_status(str(e))
+            # Show the mode the motor actually ended up in
+            motor = self.controller.motor
+            self._params.closed_loop.setValue(bool(motor.get_axis_parameter(motor.AP.CLInitFlag)))
+
+    def _on_refresh_devices(self, value: bool):
+        if value:
+            self._refresh_device_list(force=True)
+            self._release_push(self._params.refresh_devices)
+
+    def _on_set_reference_position(self, value: bool):
+        if value:
+            self.controller.set_reference_position()
+            self._cached_position = None
+            self._release_push(self._params.set_reference_position)
+
+    def _on_detect_encoder(self, value: bool):
+        # detect encoder resolution
+        if value:
+            self._start_encoder_detection()
+
+    def _on_encoder_resolution(self, value: int):
+        if value > 0:
+            self.controller.motor.set_axis_parameter(self.controller.motor.AP.EncoderResolution, value)
+            self._params.encoder_position.setValue(0)
+
+    def _on_endstop_handling(self, value: bool):
+        if value:
+            # Enable endstop detection
+            self.controller.motor.set_axis_parameter(self.controller.motor.AP.RightLimitSwitchDiable, 0)
+            self._throttle_polling(10)
+            self.controller.motor.set_axis_parameter(self.controller.motor.AP.LeftLimitSwitchDisable, 0)
+
+            # Connect end stop hit signal
+            self._signals = EndStopHitSignal()
+            self._signals.end_stop_hit.connect(self.on_end_stop_hit)
+        else:
+            # Disable endstop detection
+            self.controller.motor.set_axis_parameter(self.controller.motor.AP.RightLimitSwitchDiable, 1)
+            self._throttle_polling(10)
+            self.controller.motor.set_axis_parameter(self.controller.motor.AP.LeftLimitSwitchDisable, 1)
+
+            # Disconnect end stop hit signal
+            self._signals.end_stop_hit.disconnect(self.on_end_stop_hit)
+            self._signals = None
+
+    def _start_encoder_detection(self):
+        """Start the encoder initialization and poll its state from a timer instead of blocking"""
+        self._update_status("Detecting encoder resolution")
+        self.controller.motor.set_axis_parameter(self.controller.motor.AP.EncoderInitialization, 1)
+        self._encoder_deadline = time.monotonic() + self._encoder_detection_timeout_s
+        if self._encoder_timer is None:
+            self._encoder_timer = QtCore.QTimer()
+            self._encoder_timer.setInterval(100)
+            self._encoder_timer.timeout.connect(self._poll_encoder_detection)
+        self._encoder_timer.start()
+
+    def _poll_encoder_detection(self):
+        """Check once whether the encoder initialization is done, stop polling on success or timeout"""
+        if self.controller is None:
+            self._encoder_timer.stop()
+            return
+        motor = self.controller.motor
+        if motor.get_axis_parameter(motor.AP.EncoderInitialization) == 2:
+            self._encoder_timer.stop()
+            resolution = motor.get_axis_parameter(motor.AP.EncoderResolution)
+            self._params.encoder_resolution.setValue(resolution)
+            self._release_push(self._params.detect_encoder)
+            self._update_status(f"Encoder resolution = {resolution}")
+        elif time.monotonic() >= self._encoder_deadline:
+            self._encoder_timer.stop()
+            self._update_status("Timeout while detecting encoder resolution")
+            self._release_push(self._params.detect_encoder)
+
+    def _update_status(self, message: str):
+        """Display a status message in the module, PyMoDAQ also logs it"""
+        self.emit_status(ThreadCommand('Update_Status', [message]))
+
+    @staticmethod
+    def _release_push(param: Parameter):
+        """Set a push button parameter back to False, setValue already emits sigValueChanged when it changes"""
+        param.setValue(False)
+
+    def _refresh_device_list(self, force: bool = False) -> dict:
+        """Probe the serial ports and update the list of selectable devices"""
+        devices = self.manager.probe_tmcl_ports(force=force)
+        param = self._params.connected_devices
+        if param.opts.get('limits') != devices['ports']:
+            param.setLimits(devices['ports'])
+        return devices
 
     def _throttle_polling(self, min_interval_ms: float = 10.0):
         """Ensures that polls to the hardware are not too frequent."""
@@ -314,7 +397,15 @@ class DAQ_Move_Trinamic(DAQ_Move_base):
         remaining = min_interval_ms - elapsed_ms
         if remaining > 0:
             QtCore.QThread.msleep(int(remaining))
-        self._last_poll_time = time.perf_counter()            
+        self._last_poll_time = time.perf_counter()
+
+    def _is_resting_at(self, steps: int) -> bool:
+        """Check whether the motor already rests at the given microstep position, so a motion command can be skipped"""
+        return self._cached_position == steps and self.controller.motor.get_position_reached()
+
+    def _invalidate_position(self):
+        """Drop the cached position, the motor just received a new motion command."""
+        self._cached_position = None
 
 if __name__ == '__main__':
     main(__file__, init=False)
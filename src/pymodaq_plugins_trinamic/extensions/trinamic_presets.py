@@ -1,4 +1,5 @@
 from qtpy import QtWidgets, QtCore
+from datetime import datetime as _dt
 from pathlib import Path
 from typing import Optional
 import json
@@ -9,11 +10,17 @@ from pymodaq_utils.logger import set_logger, get_module_name
 
 from pymodaq.utils.config import Config as PyMoConfig
 from pymodaq.extensions.utils import CustomExt
+from pymodaq.control_modules.move_utility_classes import DataActuator
 
 from pymodaq_gui.parameter import utils as putils
 
 logger = set_logger(get_module_name(__file__))
 
+# (prefix, color) used to render each log level in the status widget
+_LEVELS = {'error': ('ERROR', 'red'),
+           'warning': ('WARNING', 'orange'),
+           'info': ('INFO', 'black')}
+
 config_utils = Config()
 config_pymodaq = PyMoConfig()
 
@@ -27,6 +34,44 @@ class TrinamicPresetsConfig(Config):
 trinamic_config = TrinamicPresetsConfig()
 
 
+# Shared by the four preset buttons
+_PRESET_BUTTON_STYLE = """
+    QPushButton {
+        font-size: 16pt;
+        font-weight: bold;
+        border: 2px solid #555;
+        border-radius: 10px;
+        background-color: qlineargradient(x1:0, y1:0, x2:0, y2:1,
+                                          stop:0 #4a90e2, stop:1 #357abd);
+        color: white;
+        padding: 10px;
+    }
+    QPushButton:hover {
+        background-color: qlineargradient(x1:0, y1:0, x2:0, y2:1,
+                                          stop:0 #5aa0f2, stop:1 #458acf);
+    }
+    QPushButton:pressed {
+        background-color: qlineargradient(x1:0, y1:0, x2:0, y2:1,
+                                          stop:0 #357abd, stop:1 #2a6a9f);
+    }
+    QPushButton:disabled {
+        background-color: #cccccc;
+        color: #666666;
+        border: 2px solid #999;
+    }
+"""
+
+
+def _preset_group(index: int, position: float) -> dict:
+    """Parameter group describing one preset position"""
+    return {'title': f'Preset {index}', 'name': f'preset{index}', 'type': 'group', 'children': [
+        {'title': 'Enabled:', 'name': 'enabled', 'type': 'bool', 'value': True},
+        {'title': 'Label:', 'name': 'label', 'type': 'str', 'value': f'Position {index}'},
+        {'title': 'Position:', 'name': 'position', 'type': 'float', 'value': position},
+        {'title': 'Set Current', 'name': 'set_current', 'type': 'action'},
+    ]}
+
+
 class TrinamicPresets(CustomExt):
     """
     PyMoDAQ Extension for Trinamic motor preset positions.
@@ -46,42 +91,40 @@ class TrinamicPresets(CustomExt):
          ]},
         {'title': 'Preset Positions', 'name': 'presets', 'type': 'group', 'expanded': True,
          'children': [
-             {'title': 'Preset 1', 'name': 'preset1', 'type': 'group', 'children': [
-                 {'title': 'Enabled:', 'name': 'enabled', 'type': 'bool', 'value': True},
-                 {'title': 'Label:', 'name': 'label', 'type': 'str', 'value': 'Position 1'},
-                 {'title': 'Position:', 'name': 'position', 'type': 'float', 'value': 0.0},
-                 {'title': 'Set Current', 'name': 'set_current', 'type': 'action'},
-             ]},
-             {'title': 'Preset 2', 'name': 'preset2', 'type': 'group', 'children': [
-                 {'title': 'Enabled:', 'name': 'enabled', 'type': 'bool', 'value': True},
-                 {'title': 'Label:', 'name': 'label', 'type': 'str', 'value': 'Position 2'},
-                 {'title': 'Position:', 'name': 'position', 'type': 'float', 'value': 1000.0},
-                 {'title': 'Set Current', 'name': 'set_current', 'type': 'action'},
-             ]},
-             {'title': 'Preset 3', 'name': 'preset3', 'type': 'group', 'children': [
-                 {'title': 'Enabled:', 'name': 'enabled', 'type': 'bool', 'value': True},
-                 {'title': 'Label:', 'name': 'label', 'type': 'str', 'value': 'Position 3'},
-                 {'title': 'Position:', 'name': 'position', 'type': 'float', 'value': 2000.0},
-                 {'title': 'Set Current', 'name': 'set_current', 'type': 'action'},
-             ]},
-             {'title': 'Preset 4', 'name': 'preset4', 'type': 'group', 'children': [
-                 {'title': 'Enabled:', 'name': 'enabled', 'type': 'bool', 'value': True},
-                 {'title': 'Label:', 'name': 'label', 'type': 'str', 'value': 'Position 4'},
-                 {'title': 'Position:', 'name': 'position', 'type': 'float', 'value': 3000.0},
-                 {'title': 'Set Current', 'name': 'set_current', 'type': 'action'},
-             ]},
+             _preset_group(i, position) for i, position in enumerate([0.0, 1000.0, 2000.0, 3000.0], start=1)
          ]},
     ]
 
     def __init__(self, parent: gutils.DockArea, dashboard):
         super().__init__(parent, dashboard)
         self.actuator_module = None
+
+        # Preset parameters looked up once, keyed by preset number then field name
+        self._preset_params = {
+            i: {field: self.settings.child('presets', f'preset{i}', field)
+                for field in ('enabled', 'label', 'position')}
+            for i in range(1, 5)}
+
+        # Status messages are appended to the log widget in batches, at most every 100 ms
+        self._log_buffer = []
+        self._log_timer = QtCore.QTimer()
+        self._log_timer.setSingleShot(True)
+        self._log_timer.setInterval(100)
+        self._log_timer.timeout.connect(self._flush_log)
+
         self.setup_ui()
 
+        # The position display follows the actuator value at most every 50 ms
+        self._pending_position = None
+        self._position_timer = QtCore.QTimer()
+        self._position_timer.setSingleShot(True)
+        self._position_timer.setInterval(50)
+        self._position_timer.timeout.connect(self._flush_current_position)
+
         # Connect the "Set Current" actions
         for i in range(1, 5):
             self.settings.child('presets', f'preset{i}', 'set_current').sigActivated.connect(
-                lambda checked, idx=i: self.set_preset_to_current(idx))
+                self._on_set_current_activated)
         
         # Connect the "Get Current Position" action
         self.settings.child('actuator_settings', 'get_current_pos').sigActivated.connect(
@@ -105,32 +148,9 @@ class TrinamicPresets(CustomExt):
             btn = QtWidgets.QPushButton()
             btn.setMinimumHeight(100)
             btn.setMinimumWidth(200)
-            btn.setStyleSheet("""
-                QPushButton {
-                    font-size: 16pt;
-                    font-weight: bold;
-                    border: 2px solid #555;
-                    border-radius: 10px;
-                    background-color: qlineargradient(x1:0, y1:0, x2:0, y2:1,
-                                                      stop:0 #4a90e2, stop:1 #357abd);
-                    color: white;
-                    padding: 10px;
-                }
-                QPushButton:hover {
-                    background-color: qlineargradient(x1:0, y1:0, x2:0, y2:1,
-                                                      stop:0 #5aa0f2, stop:1 #458acf);
-                }
-                QPushButton:pressed {
-                    background-color: qlineargradient(x1:0, y1:0, x2:0, y2:1,
-                                                      stop:0 #357abd, stop:1 #2a6a9f);
-                }
-                QPushButton:disabled {
-                    background-color: #cccccc;
-                    color: #666666;
-                    border: 2px solid #999;
-                }
-            """)
-            btn.clicked.connect(lambda checked, idx=i: self.goto_preset(idx))
+            btn.setStyleSheet(_PRESET_BUTTON_STYLE)
+            btn.setProperty('preset_index', i)
+            btn.clicked.connect(self._on_preset_clicked)
             self.preset_buttons[i] = btn
             
             # Arrange buttons in 2x2 grid
@@ -251,6 +271,7 @@ class TrinamicPresets(CustomExt):
 
         self.update_button_states()
 
+    @QtCore.Slot()
     def save_presets_to_json(self):
         start_dir = self.get_last_directory()
 
@@ -274,6 +295,7 @@ class TrinamicPresets(CustomExt):
 
         self.log_message(f"Presets saved to:\n{filename}")
 
+    @QtCore.Slot()
     def load_presets_from_json(self):
         start_dir = self.get_last_directory()
 
@@ -299,25 +321,25 @@ class TrinamicPresets(CustomExt):
         """Handle parameter value changes"""
         if param.name() == 'actuator_name':
             self.refresh_actuator()
-        elif param.name() == 'enabled':
-            # Update button states when preset is enabled/disabled
-            self.update_button_states()
-        elif param.name() == 'label':
-            # Update button labels when preset label changes
-            self.update_button_states()
-        elif param.name() == 'position':
-            # Update button labels when preset label changes
-            self.update_button_states()            
+        elif param.name() in ('enabled', 'label', 'position'):
+            # Only the button of the edited preset needs refreshing
+            self._refresh_button(self._preset_index(param.parent().name()))
 
+    @QtCore.Slot()
     def refresh_actuator(self):
         """Refresh the connection to the actuator module"""
         actuator_name = self.settings['actuator_settings', 'actuator_name']
         try:
+            if self.actuator_module is not None:
+                try:
+                    self.actuator_module.current_value_signal.disconnect(self._on_current_value)
+                except (TypeError, RuntimeError):
+                    pass
             self.actuator_module = self.dashboard.modules_manager.get_mod_from_name(
                 actuator_name, 'act')
             if self.actuator_module is not None:
                 self.log_message(f"Connected to actuator: {actuator_name}")
-                self.actuator_module.current_value_signal.connect(lambda cur_pos: self.update_current_position(cur_pos))
+                self.actuator_module.current_value_signal.connect(self._on_current_value)
                 self.update_current_position()
             else:
                 self.log_message(f"Warning: Could not find actuator '{actuator_name}'", 
@@ -326,50 +348,90 @@ class TrinamicPresets(CustomExt):
             self.log_message(f"Error connecting to actuator: {str(e)}", level='error')
             logger.exception(str(e))
 
+    @QtCore.Slot()
     def update_current_position(self, current_pos=None):
         """Update the current position display"""
+        if current_pos is None:
+            pos_value = self._read_current_position()
+            if pos_value is None:
+                if self.actuator_module is None:
+                    self.position_display.setText("Current Position: Not Connected")
+                else:
+                    self.position_display.setText("Current Position: ERROR")
+                return None
+            self._display_position(pos_value)
+            return pos_value
+
         if self.actuator_module is None:
             self.refresh_actuator()
-        
         if self.actuator_module is not None:
-            if current_pos is None:
-                try:
-                    current_pos = self.actuator_module._current_value
-                    # Handle DataActuator object
-                    if hasattr(current_pos, 'value'):
-                        pos_value = current_pos.value()
-                    else:
-                        pos_value = float(current_pos)
-                    
-                    self.settings.child('actuator_settings', 'current_position').setValue(pos_value)
-                    self.position_display.setText(f"Current Position: {pos_value:.2f}")
-                    return pos_value
-                except Exception as e:
-                    self.log_message(f"Error getting current position: {str(e)}", level='error')
-                    self.position_display.setText("Current Position: ERROR")
-                    return None
-            else:
-                # Handle DataActuator object
-                if hasattr(current_pos, 'value'):
-                    pos_value = current_pos.value()
-                else:
-                    pos_value = float(current_pos)
-                
-                self.settings.child('actuator_settings', 'current_position').setValue(pos_value)
-                self.position_display.setText(f"Current Position: {pos_value:.2f}")
+            self._display_position(self._position_to_float(current_pos))
         else:
             self.position_display.setText("Current Position: Not Connected")
         return None
 
+    def _read_current_position(self) -> Optional[float]:
+        """Read the actuator current value without updating the display"""
+        if self.actuator_module is None:
+            self.refresh_actuator()
+        if self.actuator_module is None:
+            return None
+        try:
+            return self._position_to_float(self.actuator_module._current_value)
+        except Exception as e:
+            self.log_message(f"Error getting current position: {str(e)}", level='error')
+            return None
+
+    def _display_position(self, pos_value: float):
+        """Show a position in the settings tree and in the large label"""
+        self.settings.child('actuator_settings', 'current_position').setValue(pos_value)
+        self.position_display.setText(f"Current Position: {pos_value:.2f}")
+
+    @staticmethod
+    def _position_to_float(current_pos) -> float:
+        # Handle DataActuator object
+        if hasattr(current_pos, 'value'):
+            return current_pos.value()
+        return float(current_pos)
+
+    @QtCore.Slot(object)
+    def _on_current_value(self, current_pos):
+        """Keep the latest actuator value and schedule a display refresh"""
+        self._pending_position = current_pos
+        if not self._position_timer.isActive():
+            self._position_timer.start()
+
+    @QtCore.Slot()
+    def _flush_current_position(self):
+        """Display the latest actuator value received"""
+        self.update_current_position(self._pending_position)
+
+    @staticmethod
+    def _preset_index(name: str) -> int:
+        """Preset number from the name of its parameter group, e.g. 'preset3' -> 3"""
+        return int(name.removeprefix('preset'))
+
+    @QtCore.Slot()
+    def _on_preset_clicked(self):
+        """Move to the preset of the button that was clicked"""
+        self.goto_preset(self.sender().property('preset_index'))
+
+    @QtCore.Slot(object)
+    def _on_set_current_activated(self, param):
+        """Store the current position in the preset owning the activated action"""
+        self.set_preset_to_current(self._preset_index(param.parent().name()))
+
+    @QtCore.Slot(int)
     def set_preset_to_current(self, preset_num: int):
         """Set a preset position to the current motor position"""
-        current_pos = self.update_current_position()
+        current_pos = self._read_current_position()
         if current_pos is not None:
-            self.settings.child('presets', f'preset{preset_num}', 'position').setValue(
-                current_pos)
-            label = self.settings['presets', f'preset{preset_num}', 'label']
+            # value_changed refreshes the button of this preset only
+            self._preset_params[preset_num]['position'].setValue(current_pos)
+            label = self._preset_params[preset_num]['label'].value()
             self.log_message(f"Set '{label}' to position {current_pos}")
 
+    @QtCore.Slot(int)
     def goto_preset(self, preset_num: int):
         """Move the actuator to a preset position"""
         if self.actuator_module is None:
@@ -377,21 +439,20 @@ class TrinamicPresets(CustomExt):
                            level='warning')
             return
         
-        preset_path = ('presets', f'preset{preset_num}')
+        preset = self._preset_params[preset_num]
         
         # Check if preset is enabled
-        if not self.settings[preset_path + ('enabled',)]:
+        if not preset['enabled'].value():
             self.log_message(f"Preset {preset_num} is disabled", level='warning')
             return
         
-        target_position = self.settings[preset_path + ('position',)]
-        label = self.settings[preset_path + ('label',)]
+        target_position = preset['position'].value()
+        label = preset['label'].value()
         
         try:
             self.log_message(f"Moving to '{label}' at position {target_position}")
             
             # Move the actuator
-            from pymodaq.control_modules.move_utility_classes import DataActuator
             self.actuator_module.move_abs(DataActuator(data=target_position))
             
             self.log_message(f"Move command sent to '{label}'")
@@ -400,6 +461,7 @@ class TrinamicPresets(CustomExt):
             self.log_message(f"Error moving to preset: {str(e)}", level='error')
             logger.exception(str(e))
 
+    @QtCore.Slot()
     def stop_motion(self):
         """Emergency stop the actuator"""
         if self.actuator_module is not None:
@@ -411,37 +473,31 @@ class TrinamicPresets(CustomExt):
         else:
             self.log_message("No actuator connected", level='warning')
 
+    @QtCore.Slot()
     def update_button_states(self):
         """Update button labels and enabled states based on preset settings"""
-        for i in range(1, 5):
-            preset_path = ('presets', f'preset{i}')
-            enabled = self.settings[preset_path + ('enabled',)]
-            label = self.settings[preset_path + ('label',)]
-            position = self.settings[preset_path + ('position',)]
-            
-            # Update the large button
-            btn = self.preset_buttons[i]
-            btn_text = f"{label}\n{position:.2f}"
-            btn.setText(btn_text)
-            btn.setEnabled(enabled)
+        for i in self._preset_params:
+            self._refresh_button(i)
+
+    def _refresh_button(self, preset_num: int):
+        """Update the label and enabled state of a single preset button"""
+        preset = self._preset_params[preset_num]
+        label = preset['label'].value()
+        position = preset['position'].value()
+
+        btn = self.preset_buttons[preset_num]
+        btn.setText(f"{label}\n{position:.2f}")
+        btn.setEnabled(preset['enabled'].value())
 
     def log_message(self, message: str, level: str = 'info'):
         """Log a message to the status text widget"""
-        import datetime
-        timestamp = datetime.datetime.now().strftime('%H:%M:%S')
-        
-        if level == 'error':
-            color = 'red'
-            prefix = 'ERROR'
-        elif level == 'warning':
-            color = 'orange'
-            prefix = 'WARNING'
-        else:
-            color = 'black'
-            prefix = 'INFO'
-        
+        timestamp = _dt.now().strftime('%H:%M:%S')
+        prefix, color = _LEVELS.get(level, _LEVELS['info'])
+
         formatted_msg = f'<span style="color:{color}">[{timestamp}] {prefix}: {message}</span>'
-        self.status_text.append(formatted_msg)
+        self._log_buffer.append(formatted_msg)
+        if not self._log_timer.isActive():
+            self._log_timer.start()
         
         # Also log to logger
         if level == 'error':
@@ -451,6 +507,13 @@ class TrinamicPresets(CustomExt):
         else:
             logger.info(message)
 
+    @QtCore.Slot()
+    def _flush_log(self):
+        """Append the buffered messages to the status text widget in one go"""
+        if self._log_buffer:
+            self.status_text.append('<br>'.join(self._log_buffer))
+            self._log_buffer.clear()
+
     def get_last_directory(self, default=None):
         try:
             last_dir = trinamic_config[('last_directory',)]
@@ -467,8 +530,15 @@ class TrinamicPresets(CustomExt):
         trinamic_config[('last_directory',)] = directory
         trinamic_config.save()
 
+    @QtCore.Slot()
     def quit_fun(self):
         """Close the extension"""
+        # Flush now rather than from a timer firing into widgets being deleted
+        self._log_timer.stop()
+        self._flush_log()
+        if self._position_timer.isActive():
+            self._position_timer.stop()
+            self._flush_current_position()
         self.mainwindow.close()
 
 def main():
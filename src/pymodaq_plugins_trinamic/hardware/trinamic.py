@@ -4,19 +4,37 @@ from pytrinamic.connections import SerialTmclInterface, UsbTmclInterface, Connec
 from serial.tools import list_ports
 import time
 
+from pymodaq_utils.logger import set_logger, get_module_name
+
+logger = set_logger(get_module_name(__file__))
+
 if not hasattr(QtCore, "pyqtSignal"):
     QtCore.pyqtSignal = QtCore.Signal  # type: ignore
 
 
 class TrinamicManager:
+    probe_ttl_s = 2.0  # A probe result younger than this is reused unless a rescan is forced
+    native_usb_vid = 0x2A3C  # Trinamic USB vendor id, reported by modules with a native USB CDC port
+
     def __init__(self, baudrate):
         self.devices = None
-        self.connections = []
-        self.interfaces = []
+        self._probe_time = 0.0
+        self.interfaces_by_port = {}
         self._baudrate = baudrate
 
-    def probe_tmcl_ports(self):
-        self.devices = {'ports':[], 'serial_numbers':[]}
+    @property
+    def connections(self):
+        return list(self.interfaces_by_port.keys())
+
+    @property
+    def interfaces(self):
+        return list(self.interfaces_by_port.values())
+
+    def probe_tmcl_ports(self, force=False):
+        if not force and self.devices is not None and time.monotonic() - self._probe_time < self.probe_ttl_s:
+            return self.devices
+
+        self.devices = {'ports':[], 'serial_numbers':[], 'native_usb':[]}
 
         for port in list_ports.comports():
             try:
@@ -27,115 +45,124 @@ class TrinamicManager:
                     if not port.manufacturer == 'Trinamic Motion Control':
                         continue
                 self.devices['ports'].append(port.device)
-                self.devices['serial_numbers'].append(port.serial_number)                    
+                self.devices['serial_numbers'].append(port.serial_number)
+                # The baudrate is not used on the wire by native USB CDC ports, unlike USB-serial adapters
+                self.devices['native_usb'].append(port.vid == self.native_usb_vid)
             except Exception:
                 continue
+        self._probe_time = time.monotonic()
         return self.devices
 
     def connect(self, port):
+        # Release an interface still open on this port (re-Init), its handle would otherwise leak
+        self.close(port)
         try:
             conn = UsbTmclInterface(port, datarate=self._baudrate)
-            self.interfaces.append(conn)
-            self.connections.append(port)
+            self.interfaces_by_port[port] = conn
         except Exception as e:
-            print(f"Failed to connect to TMCL device at {port}: {e}")
+            logger.error("Failed to connect to TMCL device at %s: %s", port, e)
 
     def close(self, port):
         try:
-            if port in self.connections:
-                index = self.connections.index(port)
-                self.interfaces[index].close()
-                # Clean up both lists
-                del self.interfaces[index]
-                del self.connections[index]
-            else:
-                pass
+            if port in self.interfaces_by_port:
+                self.interfaces_by_port.pop(port).close()
         except Exception as e:
-            pass
+            logger.debug("Failed to close TMCL device at %s: %s", port, e)
         
 
 class TrinamicController:
+    # Microstep resolution choices, mapped to the motor ENUM attribute names
+    _MICROSTEP_RESOLUTIONS = {
+        "Full": "MicrostepResolutionFullstep",
+        "Half": "MicrostepResolutionHalfstep",
+        "4": "MicrostepResolution4Microsteps",
+        "8": "MicrostepResolution8Microsteps",
+        "16": "MicrostepResolution16Microsteps",
+        "32": "MicrostepResolution32Microsteps",
+        "64": "MicrostepResolution64Microsteps",
+        "128": "MicrostepResolution128Microsteps",
+        "256": "MicrostepResolution256Microsteps",
+    }
+
     def __init__(self, device_info):
         self.port = device_info['port']
         self.serial_number = device_info['serial_number']
         self.module = None
         self.motor = None
+        self._drive_settings = None  # Motor sub-objects, resolved once in connect_motor
+        self._linear_ramp = None
         self.reference_position = 0
         self.favorite_positions = None
+        self._relative_motion = None  # Positioning mode last written to the motor, None if unknown
 
     def connect_module(self, module_type, interface) -> None:
         try:
             self.module = module_type(interface)
         except Exception as e:
-            print(f"Failed to connect to module: {e}")
+            logger.error("Failed to connect to module: %s", e)
 
     def connect_motor(self) -> None:
         try:
             self.motor = self.module.motors[0]
+            self._drive_settings = self.motor.drive_settings
+            self._linear_ramp = self.motor.linear_ramp
+            self._relative_motion = None
         except Exception as e:
-            print(f"Failed to connect to motor: {e}")
+            logger.error("Failed to connect to motor: %s", e)
+
+    def apply_settings(self, **settings) -> None:
+        """Write the given drive/ramp settings, each keyword being one of the properties below."""
+        for name, value in settings.items():
+            setattr(self, name, value)
 
     @property 
     def max_current(self):
-        return self.motor.drive_settings.max_current
+        return self._drive_settings.max_current
     
     @max_current.setter
     def max_current(self, value):
-        self.motor.drive_settings.max_current = value
+        self._drive_settings.max_current = value
     
     @property
     def standby_current(self):
-        return self.motor.drive_settings.standby_current
+        return self._drive_settings.standby_current
     
     @standby_current.setter
     def standby_current(self, value):
-        self.motor.drive_settings.standby_current = value
+        self._drive_settings.standby_current = value
     
     @property
     def boost_current(self):
-        return self.motor.drive_settings.boost_current
+        return self._drive_settings.boost_current
     
     @boost_current.setter
     def boost_current(self, value):
-        self.motor.drive_settings.boost_current = value
+        self._drive_settings.boost_current = value
     
     @property
     def microstep_resolution(self):
-        return self.motor.drive_settings.microstep_resolution
+        return self._drive_settings.microstep_resolution
     
     @microstep_resolution.setter
     def microstep_resolution(self, value):
-        if value == "Full":
-            self.motor.drive_settings.microstep_resolution = self.motor.ENUM.MicrostepResolutionFullstep
-        elif value == "Half":
-            self.motor.drive_settings.microstep_resolution = self.motor.ENUM.MicrostepResolutionHalfstep
-        elif value == "4":
-            self.motor.drive_settings.microstep_resolution = self.motor.ENUM.MicrostepResolution4Microsteps
-        elif value == "8":
-            self.motor.drive_settings.microstep_resolution = self.motor.ENUM.MicrostepResolution8Microsteps
-        elif value == "16":
-            self.motor.drive_settings.microstep_resolution = self.motor.ENUM.MicrostepResolution16Microsteps
-        elif value == "32":
-            self.motor.drive_settings.microstep_resolution = self.motor.ENUM.MicrostepResolution32Microsteps
-        elif value == "64":
-            self.motor.drive_settings.microstep_resolution = self.motor.ENUM.MicrostepResolution64Microsteps
-        elif value == "128":
-            self.motor.drive_settings.microstep_resolution = self.motor.ENUM.MicrostepResolution128Microsteps
-        elif value == "256":
-            self.motor.drive_settings.microstep_resolution = self.motor.ENUM.MicrostepResolution256Microsteps
+        try:
+            enum_name = self._MICROSTEP_RESOLUTIONS[value]
+        except KeyError:
+            raise ValueError(f"Unknown microstep resolution: {value}")
+        self._drive_settings.microstep_resolution = getattr(self.motor.ENUM, enum_name)
 
     @property
     def max_velocity(self):
-        return self.motor.linear_ramp.max_velocity
+        return self._linear_ramp.max_velocity
     @max_velocity.setter
     def max_velocity(self, value):
-        self.motor.linear_ramp.max_velocity = value
+        self._linear_ramp.max_velocity = value
     @property
     def max_acceleration(self):
-        return self.motor.linear_ramp.max_acceleration
+        return self._linear_ramp.max_acceleration
     @max_acceleration.setter
     def max_acceleration(self, value):
-        self.motor.linear_ramp.max_acceleration = value
+        self._linear_ramp.max_acceleration = value
 
     @property
     def actual_position(self):
@@ -151,21 +178,27 @@ class TrinamicController:
     def target_velocity(self):
         return self.motor.target_velocity
     
-    def set_closed_loop_mode(self, value):
-        if value:
-            self.motor.set_axis_parameter(self.motor.AP.ClosedLoopMode, 1)
-            while self.motor.get_axis_parameter(self.motor.AP.CLInitFlag) != 1:
-                QtCore.QThread.msleep(100)
-        else:
-            self.motor.set_axis_parameter(self.motor.AP.ClosedLoopMode, 0)
-            while self.motor.get_axis_parameter(self.motor.AP.CLInitFlag) != 0:
-                QtCore.QThread.msleep(100)
+    def set_closed_loop_mode(self, value, timeout=10.0):
+        target = 1 if value else 0
+        self.motor.set_axis_parameter(self.motor.AP.ClosedLoopMode, target)
+        # Poll the init flag quickly at first, then back off up to 200 ms
+        delay_ms = 10
+        deadline = time.monotonic() + timeout
+        while self.motor.get_axis_parameter(self.motor.AP.CLInitFlag) != target:
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Closed loop init flag did not reach {target} within {timeout} s")
+            QtCore.QThread.msleep(delay_ms)
+            delay_ms = min(delay_ms * 2, 200)
 
     def set_relative_motion(self) -> None:
-        self.motor.set_axis_parameter(self.motor.AP.RelativePositioningOption, 1)
+        if self._relative_motion is not True:
+            self.motor.set_axis_parameter(self.motor.AP.RelativePositioningOption, 1)
+            self._relative_motion = True
 
     def set_absolute_motion(self) -> None:
-        self.motor.set_axis_parameter(self.motor.AP.RelativePositioningOption, 0)
+        if self._relative_motion is not False:
+            self.motor.set_axis_parameter(self.motor.AP.RelativePositioningOption, 0)
+            self._relative_motion = False
     
     def set_reference_position(self) -> None:
         self.stop()
@@ -173,16 +206,16 @@ class TrinamicController:
         self.stop()
 
     def rotate(self, direction: int) -> None:
-        self.motor.rotate(direction * self.motor.linear_ramp.max_velocity)
+        self.motor.rotate(direction * self._linear_ramp.max_velocity)
     
     def move_to(self, position) -> None:
-        self.motor.move_to(position, self.motor.linear_ramp.max_velocity)
+        self.motor.move_to(position, self._linear_ramp.max_velocity)
 
     def move_by(self, difference) -> None:
-        self.motor.move_by(difference, self.motor.linear_ramp.max_velocity)
+        self.motor.move_by(difference, self._linear_ramp.max_velocity)
 
     def move_to_reference(self) -> None:
-        self.motor.move_to(0, self.motor.linear_ramp.max_velocity)
+        self.motor.move_to(0, self._linear_ramp.max_velocity)
     
     def stop(self) -> None:
         self.motor.stop()
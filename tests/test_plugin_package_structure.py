@@ -7,7 +7,8 @@ Created the 17/10/2023
 import pytest
 from pathlib import Path
 import importlib
-import pkgutil
+from importlib.resources import files
+from functools import lru_cache
 
 
 MANDATORY_MOVE_METHODS = ['ini_attributes', 'get_actuator_value', 'close', 'commit_settings',
@@ -21,27 +22,27 @@ def get_package_name():
     package_name = here.parent.stem
     return package_name
 
+@lru_cache(maxsize=None)
 def get_move_plugins():
     pkg_name = get_package_name()
     try:
         move_mod = importlib.import_module(f'{pkg_name}.daq_move_plugins')
-        plugin_list = [mod for mod in [mod[1] for mod in
-                                       pkgutil.iter_modules([str(move_mod.path.parent)])]
-                       if 'daq_move_' in mod]
+        plugin_list = [entry.name[:-len('.py')] for entry in files(move_mod).iterdir()
+                       if entry.name.endswith('.py') and entry.name.startswith('daq_move_')]
     except ModuleNotFoundError:
         plugin_list = []
         move_mod = None
     return plugin_list, move_mod
 
 
+@lru_cache(maxsize=None)
 def get_viewer_plugins(dim='0D'):
     pkg_name = get_package_name()
     try:
         viewer_mod = importlib.import_module(f'{pkg_name}.daq_viewer_plugins.plugins_{dim}')
 
-        plugin_list = [mod for mod in [mod[1] for mod in
-                                       pkgutil.iter_modules([str(viewer_mod.path.parent)])]
-                       if f'daq_{dim}viewer_' in mod]
+        plugin_list = [entry.name[:-len('.py')] for entry in files(viewer_mod).iterdir()
+                       if entry.name.endswith('.py') and entry.name.startswith(f'daq_{dim}viewer_')]
     except ModuleNotFoundError:
         plugin_list = []
         viewer_mod = None
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the hardware wrapper logic, using fake serial ports and a fake motor
+"""
+import pytest
+from types import SimpleNamespace
+
+from pymodaq_plugins_trinamic.hardware import trinamic
+from pymodaq_plugins_trinamic.hardware.trinamic import TrinamicManager, TrinamicController
+
+
+class FakeMotor:
+    AP = SimpleNamespace(ClosedLoopMode='ClosedLoopMode', CLInitFlag='CLInitFlag',
+                         RelativePositioningOption='RelativePositioningOption')
+    ENUM = SimpleNamespace(MicrostepResolution16Microsteps=4)
+
+    def __init__(self, follow_closed_loop=True):
+        self.drive_settings = SimpleNamespace()
+        self.linear_ramp = SimpleNamespace()
+        self.axis_parameters = {'CLInitFlag': 0}
+        self.writes = []
+        self._follow_closed_loop = follow_closed_loop  # False simulates a closed loop init that never completes
+
+    def set_axis_parameter(self, ap, value):
+        self.writes.append((ap, value))
+        self.axis_parameters[ap] = value
+        if ap == self.AP.ClosedLoopMode and self._follow_closed_loop:
+            self.axis_parameters['CLInitFlag'] = value
+
+    def get_axis_parameter(self, ap):
+        return self.axis_parameters[ap]
+
+
+def make_controller(motor):
+    controller = TrinamicController({'port': 'COM1', 'serial_number': '0001'})
+    controller.module = SimpleNamespace(motors=[motor])
+    controller.connect_motor()
+    return controller
+
+
+@pytest.fixture
+def fake_comports(monkeypatch):
+    calls = []
+    ports = [SimpleNamespace(device='/dev/ttyACM0', serial_number='0001', vid=0x2A3C,
+                             manufacturer='Trinamic Motion Control'),
+             SimpleNamespace(device='/dev/ttyUSB0', serial_number='0002', vid=0x0403,
+                             manufacturer='Trinamic Motion Control'),
+             SimpleNamespace(device='/dev/ttyS0', serial_number=None, vid=None,
+                             manufacturer=None)]
+
+    def comports():
+        calls.append(1)
+        return ports
+
+    monkeypatch.setattr(trinamic.platform, 'system', lambda: 'Linux')
+    monkeypatch.setattr(trinamic.list_ports, 'comports', comports)
+    return calls
+
+
+def test_probe_filters_ports(fake_comports):
+    devices = TrinamicManager(baudrate=115200).probe_tmcl_ports()
+    assert devices['ports'] == ['/dev/ttyACM0', '/dev/ttyUSB0']
+    assert devices['serial_numbers'] == ['0001', '0002']
+
+
+def test_probe_reuses_recent_result(fake_comports):
+    manager = TrinamicManager(baudrate=115200)
+    devices = manager.probe_tmcl_ports()
+    assert manager.probe_tmcl_ports() is devices
+    assert len(fake_comports) == 1
+
+    manager.probe_tmcl_ports(force=True)
+    assert len(fake_comports) == 2
+
+    manager._probe_time -= manager.probe_ttl_s
+    manager.probe_tmcl_ports()
+    assert len(fake_comports) == 3
+
+
+def test_probe_flags_native_usb_ports(fake_comports):
+    manager = TrinamicManager(baudrate=115200)
+    assert manager.probe_tmcl_ports()['native_usb'] == [True, False]
+
+    # The same port behind a USB-serial adapter after a rescan, its baudrate matters again
+    trinamic.list_ports.comports()[0].vid = 0x0403
+    assert manager.probe_tmcl_ports(force=True)['native_usb'] == [False, False]
+
+
+def test_positioning_mode_written_only_on_change():
+    motor = FakeMotor()
+    controller = make_controller(motor)
+    controller.set_relative_motion()
+    controller.set_relative_motion()
+    assert motor.writes == [('RelativePositioningOption', 1)]
+
+    controller.set_absolute_motion()
+    controller.set_absolute_motion()
+    assert motor.writes == [('RelativePositioningOption', 1), ('RelativePositioningOption', 0)]
+
+    controller.connect_motor()  # the mode is unknown again after a reconnection
+    controller.set_absolute_motion()
+    assert len(motor.writes) == 3
+
+
+def test_microstep_resolution():
+    motor = FakeMotor()
+    controller = make_controller(motor)
+    controller.microstep_resolution = '16'
+    assert motor.drive_settings.microstep_resolution == motor.ENUM.MicrostepResolution16Microsteps
+    with pytest.raises(ValueError):
+        controller.microstep_resolution = '3'
+
+
+def test_closed_loop_mode():
+    motor = FakeMotor()
+    controller = make_controller(motor)
+    controller.set_closed_loop_mode(True, timeout=1.0)
+    assert motor.get_axis_parameter('CLInitFlag') == 1
+
+
+def test_closed_loop_mode_timeout():
+    controller = make_controller(FakeMotor(follow_closed_loop=False))
+    with pytest.raises(TimeoutError):
+        controller.set_closed_loop_mode(True, timeout=0.05)
+
+
+def test_connect_closes_previous_interface(monkeypatch):
+    class FakeInterface:
+        def __init__(self, port, datarate):
+            self.closed = False
+
+        def close(self):
+            self.closed = True
+
+    monkeypatch.setattr(trinamic, 'UsbTmclInterface', FakeInterface)
+    manager = TrinamicManager(baudrate=115200)
+    manager.connect('COM1')
+    first = manager.interfaces_by_port['COM1']
+    manager.connect('COM1')
+    assert first.closed
+    assert manager.interfaces == [manager.interfaces_by_port['COM1']]
+    assert not manager.interfaces_by_port['COM1'].closed